@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+In-memory pipeline for annotated agent prompt files.
+
+Chains the nesting fixer (fix_xml_nesting.py) and the visualization
+generator (generate_viz.py) without temp files or subprocesses. Text is
+split once; every step works on the same list of lines.
+
+Usage:
+    from annotation_pipeline import AnnotatedDocument, annotate
+
+    # One call: renested text + parsed tree
+    text, parsed = annotate(source, agent_name="PAW")
+
+    # Chained transforms: renest -> validate -> render
+    doc = AnnotatedDocument.from_text(source, agent_name="PAW")
+    outputs = doc.renest().validate(strict=True).render()
+    outputs['summary'], outputs['mindmap'], ...
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Sequence
+
+from fix_xml_nesting import RenestResult, renest_lines, split_lines
+from generate_viz import ParsedAnnotations, generate_all, parse_lines
+
+
+class AnnotationError(ValueError):
+    """Raised by strict validation when annotation tags are unbalanced."""
+
+    def __init__(self, warnings: list[str]):
+        super().__init__('\n'.join(warnings))
+        self.warnings = warnings
+
+
+@dataclass
+class AnnotatedDocument:
+    """An annotated markdown document held in memory as a list of lines."""
+    lines: list[str] = field(default_factory=list)
+    agent_name: str = "Agent"
+    # Warnings from the most recent renest/validate step
+    warnings: list[str] = field(default_factory=list)
+    _renest: Optional[RenestResult] = field(default=None, repr=False)
+    _parsed: Optional[ParsedAnnotations] = field(default=None, repr=False)
+
+    @classmethod
+    def from_text(cls, text: str | bytes, agent_name: str = "Agent") -> 'AnnotatedDocument':
+        return cls(lines=split_lines(text), agent_name=agent_name)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], agent_name: str = "Agent") -> 'AnnotatedDocument':
+        """Build a document from lines, which should keep their line endings.
+
+        Lines without an ending are joined with \n as '\n'.join() would:
+        every line but the last gets one, so renested text and byte offsets
+        stay consistent.
+        """
+        lines = list(lines)
+        for i in range(len(lines) - 1):
+            if not lines[i].endswith(('\n', '\r')):
+                lines[i] += '\n'
+        return cls(lines=lines, agent_name=agent_name)
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.lines)
+
+    @property
+    def parsed(self) -> ParsedAnnotations:
+        """Parse tree for the current lines (computed once, then cached)."""
+        if self._parsed is None:
+            self._parsed = parse_lines(self.lines, agent_name=self.agent_name)
+        return self._parsed
+
+    def renest(self) -> 'AnnotatedDocument':
+        """Rewrite nesting prefixes in place; returns self for chaining."""
+        self._renest = renest_lines(self.lines)
+        self.lines = self._renest.lines
+        self.warnings = self._renest.warnings
+        self._parsed = None
+        return self
+
+    def validate(self, strict: bool = False) -> 'AnnotatedDocument':
+        """Check tag balance; returns self for chaining.
+
+        Reuses the result of a preceding renest() when there is one.
+
+        Raises:
+            AnnotationError: If strict and tags are mismatched or unclosed
+        """
+        if self._renest is None or self._renest.lines is not self.lines:
+            self.warnings = renest_lines(self.lines).warnings
+        if strict and self.warnings:
+            raise AnnotationError(self.warnings)
+        return self
+
+    def render(self, names: Optional[Sequence[str]] = None) -> dict[str, str]:
+        """Render visualizations (see generate_viz.GENERATORS for names)."""
+        return generate_all(self.parsed, names)
+
+
+def annotate(source: str | bytes | Iterable[str],
+             agent_name: str = "Agent") -> tuple[str, ParsedAnnotations]:
+    """Renest a document and parse the result in one call.
+
+    Args:
+        source: Document text (str/bytes) or an iterable of lines with
+            their line endings (see AnnotatedDocument.from_lines)
+
+    Returns:
+        (renested_text, parsed_annotations)
+    """
+    if isinstance(source, (str, bytes)):
+        doc = AnnotatedDocument.from_text(source, agent_name=agent_name)
+    else:
+        doc = AnnotatedDocument.from_lines(source, agent_name=agent_name)
+    doc.renest()
+    return doc.text, doc.parsed
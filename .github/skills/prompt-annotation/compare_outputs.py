@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Golden-output regression benchmark for the annotation scripts.
+
+Runs a baseline and a candidate implementation of fix_xml_nesting.py and
+generate_viz.py over every annotated markdown file in the repository
+(including .paw/work), then:
+  - diffs the renested text and all five generated artifacts byte for byte
+  - reports time and peak memory for each implementation side by side;
+    both ratios are baseline / candidate, so above 1x is better
+
+The candidate is the working tree copy next to this script. The baseline
+is loaded straight from git (default: HEAD) or from a directory, so no
+checkout or temp files are needed.
+
+Usage:
+    python compare_outputs.py                        # HEAD vs working tree
+    python compare_outputs.py --baseline main        # Any git ref
+    python compare_outputs.py --baseline-dir old/    # Directory with both scripts
+    python compare_outputs.py docs/ agents/x.md      # Only these files/dirs
+    python compare_outputs.py --show-diff            # Print unified diffs
+
+Exits 1 if any output differs.
+"""
+
+import argparse
+import contextlib
+import difflib
+import io
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from generate_viz import find_markdown
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+MODULES = ('fix_xml_nesting', 'generate_viz')
+
+# Artifact name -> generate_viz function producing it
+ARTIFACTS = {
+    'mindmap': 'generate_mindmap',
+    'markmap': 'generate_markmap',
+    'markmap_by_tag': 'generate_markmap_by_tag',
+    'flow': 'generate_flow_skeleton',
+    'summary': 'generate_summary',
+}
+OUTPUTS = ('renested',) + tuple(ARTIFACTS)
+
+@dataclass
+class Implementation:
+    """One version of the two scripts, loaded as isolated modules."""
+    label: str
+    fix_xml_nesting: types.ModuleType
+    generate_viz: types.ModuleType
+
+
+@dataclass
+class FileResult:
+    """Outputs and cost of running one implementation over one file."""
+    outputs: dict[str, str] = field(default_factory=dict)
+    seconds: float = 0.0
+    peak_bytes: int = 0
+    annotated: bool = False
+
+
+def load_implementation(label: str, read_source: Callable[[str], str]) -> Implementation:
+    """Exec both scripts into fresh modules.
+
+    generate_viz may import fix_xml_nesting, so the matching module is
+    visible in sys.modules while it loads, then the original is restored.
+    """
+    modules = {}
+    saved = {name: sys.modules.get(name) for name in MODULES}
+    try:
+        for name in MODULES:
+            module = types.ModuleType(name)
+            module.__file__ = f"<{label}>/{name}.py"
+            sys.modules[name] = module
+            exec(compile(read_source(name), module.__file__, 'exec'), module.__dict__)
+            modules[name] = module
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return Implementation(label, modules['fix_xml_nesting'], modules['generate_viz'])
+
+
+def git_source_reader(ref: str) -> Callable[[str], str]:
+    """Read a script as it exists at a git ref."""
+    prefix = git(['rev-parse', '--show-prefix'], SCRIPT_DIR).strip()
+
+    def read(name: str) -> str:
+        return git(['show', f"{ref}:{prefix}{name}.py"], SCRIPT_DIR)
+    return read
+
+
+def dir_source_reader(directory: Path) -> Callable[[str], str]:
+    def read(name: str) -> str:
+        return (directory / f"{name}.py").read_text(encoding='utf-8')
+    return read
+
+
+def git(args: list[str], cwd: Path) -> str:
+    return subprocess.run(['git', *args], cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def run_once(impl: Implementation, path: Path) -> FileResult:
+    """Renest (preview mode, no writes), parse and render one file."""
+    result = FileResult()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        result.outputs['renested'] = _guard(lambda: ''.join(impl.fix_xml_nesting.process_file(path, preview=True)))
+    try:
+        parsed = impl.generate_viz.parse_annotations(path)
+    except Exception as e:  # A crash is an output difference, not a harness failure
+        parsed = None
+        error = f"<error: {type(e).__name__}: {e}>"
+    for name, function in ARTIFACTS.items():
+        if parsed is None:
+            result.outputs[name] = error
+        else:
+            result.outputs[name] = _guard(lambda: getattr(impl.generate_viz, function)(parsed))
+    result.annotated = parsed is not None and bool(
+        parsed.root_nodes or result.outputs['renested'] != path.read_text(encoding='utf-8'))
+    return result
+
+
+def _guard(produce: Callable[[], str]) -> str:
+    try:
+        return produce()
+    except Exception as e:
+        return f"<error: {type(e).__name__}: {e}>"
+
+
+def measure(impl: Implementation, path: Path, repeat: int) -> FileResult:
+    """Run an implementation on a file: best-of-repeat time, then peak memory."""
+    result = run_once(impl, path)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_once(impl, path)
+        best = min(best, time.perf_counter() - start)
+    result.seconds = best
+
+    tracemalloc.start()
+    run_once(impl, path)
+    result.peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def format_ratio(baseline: float, candidate: float) -> str:
+    return f"{baseline / candidate:.2f}x" if candidate else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare baseline vs candidate annotation script outputs and performance.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('paths', nargs='*', type=Path,
+                        help='Files or directories to scan (default: repository root)')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--baseline', default='HEAD', help='Git ref for the baseline (default: HEAD)')
+    source.add_argument('--baseline-dir', type=Path, help='Directory holding baseline scripts')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs per file; best is kept (default: 3)')
+    parser.add_argument('--show-diff', action='store_true', help='Print unified diffs of differing outputs')
+    parser.add_argument('--all', action='store_true', help='Include markdown files without annotations')
+
+    args = parser.parse_args()
+
+    if args.baseline_dir:
+        baseline = load_implementation(str(args.baseline_dir), dir_source_reader(args.baseline_dir))
+    else:
+        try:
+            baseline = load_implementation(args.baseline, git_source_reader(args.baseline))
+        except subprocess.CalledProcessError as e:
+            print(f"Error: Cannot load baseline from git: {e.stderr.strip()}", file=sys.stderr)
+            sys.exit(1)
+    candidate = load_implementation('working tree', dir_source_reader(SCRIPT_DIR))
+
+    paths = args.paths
+    if not paths:
+        try:
+            paths = [Path(git(['rev-parse', '--show-toplevel'], SCRIPT_DIR).strip())]
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            paths = [Path.cwd()]
+    missing = [path for path in paths if not path.exists()]
+    if missing:
+        print(f"Error: Not found: {', '.join(map(str, missing))}", file=sys.stderr)
+        sys.exit(1)
+
+    rows = []
+    differences: list[tuple[Path, str, str, str]] = []
+    for path in find_markdown(paths):
+        old = measure(baseline, path, args.repeat)
+        new = measure(candidate, path, args.repeat)
+        if not (args.all or old.annotated or new.annotated):
+            continue
+        changed = [name for name in OUTPUTS if old.outputs[name] != new.outputs[name]]
+        differences.extend((path, name, old.outputs[name], new.outputs[name]) for name in changed)
+        rows.append((path, old, new, changed))
+
+    if not rows:
+        print("No annotated markdown files found")
+        return
+
+    # Side-by-side report
+    name_width = min(60, max(len(str(path)) for path, *_ in rows))
+    print(f"{'file':<{name_width}}  {'base ms':>8} {'cand ms':>8} {'speedup':>8}  "
+          f"{'base KB':>8} {'cand KB':>8} {'mem x':>6}  outputs")
+    total_old = total_new = 0.0
+    peak_old = peak_new = 0
+    for path, old, new, changed in rows:
+        total_old += old.seconds
+        total_new += new.seconds
+        peak_old = max(peak_old, old.peak_bytes)
+        peak_new = max(peak_new, new.peak_bytes)
+        label = str(path)
+        if len(label) > name_width:
+            label = '...' + label[-(name_width - 3):]
+        status = 'identical' if not changed else 'DIFF: ' + ', '.join(changed)
+        print(f"{label:<{name_width}}  {old.seconds * 1000:8.2f} {new.seconds * 1000:8.2f} "
+              f"{format_ratio(old.seconds, new.seconds):>8}  {old.peak_bytes / 1024:8.1f} "
+              f"{new.peak_bytes / 1024:8.1f} {format_ratio(old.peak_bytes, new.peak_bytes):>6}  {status}")
+
+    print()
+    print(f"baseline:  {baseline.label}")
+    print(f"candidate: {candidate.label}")
+    print(f"files: {len(rows)}, differing outputs: {len(differences)}")
+    print(f"total time: {total_old * 1000:.1f} ms -> {total_new * 1000:.1f} ms "
+          f"({format_ratio(total_old, total_new)} speedup)")
+    print(f"max peak memory: {peak_old / 1024:.1f} KB -> {peak_new / 1024:.1f} KB "
+          f"({format_ratio(peak_old, peak_new)} reduction)")
+
+    if args.show_diff:
+        for path, name, old_text, new_text in differences:
+            print(f"\n=== {path} [{name}] ===")
+            sys.stdout.writelines(difflib.unified_diff(
+                old_text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+                fromfile=f"{baseline.label}", tofile=f"{candidate.label}"))
+
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Generate one aggregated mindmap for a corpus of annotated agents and skills.
+
+Merges the annotation trees of many files under a single root, and keeps
+the result loadable by Mermaid/markmap viewers:
+  - Repeated subtrees (same tags and text, e.g. a guardrail shared by
+    several skills) are rendered once; later copies become a one-line
+    "same as" reference to the first
+  - Each page shows at most --max-depth levels and about --max-nodes nodes;
+    children that don't fit are written to separate page files, linked
+    from the node that owns them, so a viewer only loads them on demand
+  - Rendering uses explicit stacks, so deep nesting can't hit Python's
+    recursion limit
+
+Usage:
+    python corpus_map.py agents/ skills/ --output viz/corpus
+    python corpus_map.py . --output viz/corpus --max-depth 4 --max-nodes 300
+    python corpus_map.py skills/ --output viz/corpus --format mermaid
+
+Writes <name>.mm.md (or .mmd for mermaid) plus <name>-pNNNN pages.
+"""
+
+import argparse
+import hashlib
+import sys
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Sequence, Union
+
+from generate_viz import (AnnotationNode, ParsedAnnotations, find_markdown, markmap_label,
+                          mindmap_label, parse_annotations, walk_subtree)
+
+# Format -> file extension
+EXTENSIONS = {'markmap': '.mm.md', 'mermaid': '.mmd'}
+
+# A map item is a whole file (its root nodes become children) or one annotation
+MapItem = Union[ParsedAnnotations, AnnotationNode]
+
+
+@dataclass
+class Page:
+    """One output file of the map."""
+    filename: str
+    title: str
+    # (item, owning agent name) pairs rendered at the top level of the page
+    items: list[tuple[MapItem, str]] = field(default_factory=list)
+    # Page holding the rest of the items when they didn't fit on this one
+    continued: 'Page | None' = None
+
+
+def subtree_digests(parsed: ParsedAnnotations) -> dict[int, tuple[str, int]]:
+    """Map id(node) -> (content hash, subtree size) for every node in a file.
+
+    A node's hash covers its opening tag (without the nesting prefix), the
+    body lines it owns and its children's hashes in document order, so
+    subtrees only match if their full text does. Children are hashed before
+    their parents by walking the preorder list backwards; no recursion is
+    needed and each source line is read once.
+    """
+    lines = parsed.source_lines
+    digests: dict[int, tuple[str, int]] = {}
+    for node, _ in reversed(list(walk_subtree(parsed.root_nodes))):
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(node.open_text[len(node.prefix):].strip().encode('utf-8'))
+        size = 1
+        line = node.line_number + 1  # Next body line (1-based) not yet hashed
+        for child in node.children:
+            _hash_lines(hasher, lines, line, child.line_number - 1)
+            child_digest, child_size = digests[id(child)]
+            hasher.update(b'\0' + child_digest.encode('ascii'))
+            size += child_size
+            line = parsed.end_line_of(child) + 1
+        _hash_lines(hasher, lines, line, node.end_line - 1 if node.end_line else len(lines))
+        digests[id(node)] = (hasher.hexdigest(), size)
+    return digests
+
+
+def _hash_lines(hasher, lines: list[str], first: int, last: int):
+    """Feed 1-based lines first..last to hasher, ignoring line endings."""
+    for i in range(first - 1, last):
+        hasher.update(b'\n' + lines[i].rstrip('\r\n').encode('utf-8'))
+
+
+class CorpusMapRenderer:
+    """Renders merged annotation trees into budgeted, paged map files."""
+
+    def __init__(self, parsed_files: Sequence[ParsedAnnotations], title: str = "Corpus",
+                 fmt: str = 'markmap', max_depth: int = 6, max_nodes: int = 500,
+                 min_collapse: int = 2, name: str = "corpus"):
+        """
+        Args:
+            parsed_files: One ParsedAnnotations per file
+            title: Label of the map's root
+            fmt: 'markmap' or 'mermaid'
+            max_depth: Levels shown per page before subtrees move to a new page
+            max_nodes: Node (line) budget per page; must be at least 3
+            min_collapse: Smallest subtree size collapsed when repeated
+            name: Base file name for the index and its pages
+        """
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unknown format: {fmt}")
+        if max_depth < 1 or max_nodes < 3:
+            raise ValueError("max_depth must be >= 1 and max_nodes >= 3")
+        self.parsed_files = list(parsed_files)
+        self.title = title
+        self.fmt = fmt
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.min_collapse = min_collapse
+        self.name = name
+        self.digests: dict[int, tuple[str, int]] = {}
+        for parsed in self.parsed_files:
+            self.digests.update(subtree_digests(parsed))
+        # Content hash -> where it was first rendered
+        self.seen: dict[str, str] = {}
+        self.pages: list[Page] = []
+        self.queue: deque[Page] = deque()
+        self.collapsed = 0
+
+    def render(self) -> dict[str, str]:
+        """Render all pages; returns {filename: content}, index first."""
+        index = self._new_pages(self.title, [(parsed, parsed.agent_name) for parsed in self.parsed_files],
+                                filename=f"{self.name}{EXTENSIONS[self.fmt]}")
+        outputs = {}
+        while self.queue:
+            page = self.queue.popleft()
+            outputs[page.filename] = self._render_page(page)
+        # The index is always first, even if it rendered empty
+        return {index.filename: outputs.pop(index.filename), **outputs}
+
+    # -- items ---------------------------------------------------------------
+
+    def _children(self, item: MapItem) -> list[AnnotationNode]:
+        return item.root_nodes if isinstance(item, ParsedAnnotations) else item.children
+
+    def _size(self, item: MapItem) -> int:
+        if isinstance(item, ParsedAnnotations):
+            return 1 + sum(self.digests[id(node)][1] for node in item.root_nodes)
+        return self.digests[id(item)][1]
+
+    def _reserve(self, item: MapItem) -> int:
+        """Lines an item may still cost once reached: itself, plus a page link."""
+        return 2 if self._children(item) else 1
+
+    def _label(self, item: MapItem) -> str:
+        if isinstance(item, ParsedAnnotations):
+            return self._escape(item.agent_name)
+        return mindmap_label(item) if self.fmt == 'mermaid' else markmap_label(item)
+
+    def _escape(self, text: str) -> str:
+        if self.fmt == 'mermaid':
+            return text.replace('"', "'").replace('(', '[').replace(')', ']')
+        return text
+
+    def _link(self, text: str, page: Page) -> str:
+        if self.fmt == 'mermaid':
+            return f"{text} in {page.filename}"
+        return f"[{text}]({page.filename})"
+
+    # -- pages ---------------------------------------------------------------
+
+    def _new_pages(self, title: str, items: list[tuple[MapItem, str]], filename: str = "") -> Page:
+        """Queue pages holding items, chained when they exceed the budget.
+
+        Returns the first page of the chain.
+        """
+        # One line per page is kept for the "continued" link
+        budget = self.max_nodes - 1
+        chunks: list[list[tuple[MapItem, str]]] = [[]]
+        used = 0
+        for entry in items:
+            cost = self._reserve(entry[0])
+            if chunks[-1] and used + cost > budget:
+                chunks.append([])
+                used = 0
+            chunks[-1].append(entry)
+            used += cost
+
+        pages = []
+        for i, chunk in enumerate(chunks):
+            if i or not filename:
+                page_filename = f"{self.name}-p{len(self.pages) + 1:04d}{EXTENSIONS[self.fmt]}"
+            else:
+                page_filename = filename
+            page = Page(filename=page_filename, title=title if not i else f"{title} (continued)",
+                        items=chunk)
+            if pages:
+                pages[-1].continued = page
+            pages.append(page)
+            self.pages.append(page)
+            self.queue.append(page)
+        return pages[0]
+
+    def _render_page(self, page: Page) -> str:
+        """Render one page iteratively within the depth and node budgets.
+
+        Pages fill greedily: a node's children are expanded while they fit,
+        and only those that don't move to a new page, so a page holds up to
+        max_depth levels even for deep, narrow trees.
+
+        Invariant: emitted lines plus the lines reserved for items still on
+        the stack never exceed max_nodes - 1 (the last line is for the
+        "continued" link).
+        """
+        budget = self.max_nodes - 1
+        lines: list[tuple[int, str]] = []
+        # Items, or already formatted page links (str) shown after a node's children
+        stack: list[tuple[MapItem | str, str, int]] = [
+            (item, agent, 0) for item, agent in reversed(page.items)]
+        reserved = sum(self._reserve(item) for item, _ in page.items)
+
+        while stack:
+            item, agent, depth = stack.pop()
+            if isinstance(item, str):
+                reserved -= 1
+                lines.append((depth, item))
+                continue
+            reserved -= self._reserve(item)
+            label = self._label(item)
+            children = self._children(item)
+
+            if isinstance(item, AnnotationNode):
+                digest, size = self.digests[id(item)]
+                if size >= self.min_collapse:
+                    if digest in self.seen:
+                        lines.append((depth, f"{label} ↪ same as {self.seen[digest]}"))
+                        self.collapsed += 1
+                        continue
+                    location = self._escape(f"{agent} L{item.line_number}")
+                    self.seen[digest] = location if self.fmt == 'mermaid' else f"[{location}]({page.filename})"
+
+            lines.append((depth, label))
+            if not children:
+                continue
+
+            # Expand as many children as fit, keeping one line for a page link
+            shown = 0
+            if depth + 1 < self.max_depth:
+                room = budget - len(lines) - reserved - 1
+                for child in children:
+                    room -= self._reserve(child)
+                    if room < 0:
+                        break
+                    shown += 1
+            if shown < len(children):
+                # Move the rest to their own page(s), loaded on demand
+                rest = children[shown:]
+                child_page = self._new_pages(f"{agent}: {label}", [(child, agent) for child in rest])
+                count = sum(self._size(child) for child in rest)
+                stack.append((self._link(f"📄 {count} more nodes", child_page), agent, depth + 1))
+                reserved += 1
+            for child in reversed(children[:shown]):
+                stack.append((child, agent, depth + 1))
+                reserved += self._reserve(child)
+
+        if page.continued is not None:
+            lines.append((0, self._link("📄 continued", page.continued)))
+        return self._format(page.title, lines)
+
+    def _format(self, title: str, lines: list[tuple[int, str]]) -> str:
+        if self.fmt == 'mermaid':
+            output = ["```mermaid", "mindmap", f"  root(({self._escape(title)}))"]
+            output.extend(f"{'    ' * (depth + 1)}{text}" for depth, text in lines)
+            output.append("```")
+        else:
+            output = [f"# {title}"]
+            output.extend(f"{'  ' * depth}- {text}" for depth, text in lines)
+        return '\n'.join(output)
+
+
+def find_annotated_files(paths: Sequence[Path], include_empty: bool = False) -> list[ParsedAnnotations]:
+    """Parse every markdown file under paths, keeping those with annotations."""
+    parsed_files = []
+    for path in find_markdown(paths):
+        parsed = parse_annotations(path)
+        if parsed.root_nodes or include_empty:
+            parsed_files.append(parsed)
+    return parsed_files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate an aggregated, paged mindmap for many annotated prompt files.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('paths', nargs='+', type=Path, help='Markdown files or directories to include')
+    parser.add_argument('--output', '-o', type=Path, required=True, help='Directory to write map pages to')
+    parser.add_argument('--name', default='corpus', help='Base file name (default: corpus)')
+    parser.add_argument('--title', default='Corpus', help='Root label (default: Corpus)')
+    parser.add_argument('--format', choices=sorted(EXTENSIONS), default='markmap',
+                        help='Output format (default: markmap)')
+    parser.add_argument('--max-depth', type=int, default=6, help='Levels per page (default: 6)')
+    parser.add_argument('--max-nodes', type=int, default=500, help='Nodes per page (default: 500)')
+    parser.add_argument('--min-collapse', type=int, default=2,
+                        help='Smallest repeated subtree to collapse (default: 2)')
+    parser.add_argument('--all', action='store_true', help='Include files without annotations')
+
+    args = parser.parse_args()
+
+    missing = [path for path in args.paths if not path.exists()]
+    if missing:
+        print(f"Error: Not found: {', '.join(map(str, missing))}", file=sys.stderr)
+        sys.exit(1)
+
+    parsed_files = find_annotated_files(args.paths, include_empty=args.all)
+    if not parsed_files:
+        print("Error: No annotated markdown files found", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        renderer = CorpusMapRenderer(parsed_files, title=args.title, fmt=args.format,
+                                     max_depth=args.max_depth, max_nodes=args.max_nodes,
+                                     min_collapse=args.min_collapse, name=args.name)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    outputs = renderer.render()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    for filename, content in outputs.items():
+        with open(args.output / filename, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    total_nodes = sum(len(parsed.nodes) for parsed in parsed_files)
+    print(f"Generated {len(outputs)} page(s) in {args.output} from {len(parsed_files)} file(s)")
+    print(f"  {total_nodes} annotations, {renderer.collapsed} repeated subtree(s) collapsed")
+    print(f"  index: {args.output / next(iter(outputs))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -13,12 +13,55 @@ Usage:
     python fix_xml_nesting.py <file>           # Modify file in place
     python fix_xml_nesting.py <file> --dry-run # Print XML lines only to stdout
     python fix_xml_nesting.py <file> --preview # Show full file with changes to stdout
+
+Library use (no file I/O):
+    from fix_xml_nesting import renest_text
+    result = renest_text(text)   # str or bytes
+    result.text, result.warnings
 """
 
 import argparse
+import io
 import re
 import sys
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Iterable
+
+# Backticked annotation tag, e.g. `<tag attr="value">` or `</tag>`, capturing
+# (slash, name, attributes). Shared with generate_viz.py.
+# The tag body stops at a backtick (an inline code span can't contain one)
+# and (?![\w-]) stops the name from backtracking, so a long line full of
+# "`<a" without ">" is scanned in linear time instead of quadratic.
+TAG_RE = re.compile(r'`<(/?)([a-zA-Z][\w-]*)(?![\w-])([^>`]*)>`')
+TAG_CONTENT_RE = re.compile(r'(`</?[a-zA-Z][^>`]*>`)')
+
+
+@dataclass
+class RenestResult:
+    """Outcome of renesting a sequence of lines."""
+    lines: list[str] = field(default_factory=list)
+    # Dry-run style listing of each rewritten annotation line
+    annotation_lines: list[str] = field(default_factory=list)
+    # Mismatched/unclosed tag messages (printed to stderr by the CLI)
+    warnings: list[str] = field(default_factory=list)
+    unclosed: list[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.lines)
+
+
+def split_lines(text: str | bytes) -> list[str]:
+    """Split text into lines, keeping each line's original ending.
+
+    Bytes are decoded as UTF-8. Lines split on \\n, \\r\\n and \\r but keep
+    them untranslated (like ``open(newline='')``), so joining the lines
+    reproduces the input and byte offsets match the file on disk.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return io.StringIO(text, newline='').readlines()
 
 
 def format_nesting_prefix(level: int) -> str:
@@ -52,7 +95,7 @@ def extract_tag_info(line: str) -> tuple[str | None, bool]:
     # Also match without proper formatting to fix them
     
     # Pattern to find XML tags in backticks
-    match = re.search(r'`<(/?)([a-zA-Z][\w-]*)[^>]*>`', line)
+    match = TAG_RE.search(line)
     if match:
         is_closing = match.group(1) == '/'
         tag_name = match.group(2)
@@ -66,39 +109,36 @@ def is_xml_annotation_line(line: str) -> bool:
     stripped = line.strip()
     if not stripped.startswith('>'):
         return False
-    return bool(re.search(r'`</?[a-zA-Z][\w-]*[^>]*>`', line))
+    return bool(TAG_CONTENT_RE.search(line))
 
 
 def extract_tag_content(line: str) -> str | None:
     """Extract the full tag content including backticks."""
-    match = re.search(r'(`</?[a-zA-Z][\w-]*[^>]*>`)', line)
+    match = TAG_CONTENT_RE.search(line)
     if match:
         return match.group(1)
     return None
 
 
-def process_file(filepath: Path, dry_run: bool = False, preview: bool = False) -> list[str]:
-    """Process a file and fix XML annotation nesting.
-    
+def renest_lines(lines: Iterable[str]) -> RenestResult:
+    """Fix XML annotation nesting in an iterable of lines.
+
+    Pure function: nothing is read, written or printed.
+
     Args:
-        filepath: Path to the file to process
-        dry_run: If True, only output XML lines to stdout
-        preview: If True, output full file with changes to stdout
-        
+        lines: Lines of an annotated markdown document (with line endings)
+
     Returns:
-        List of processed lines
+        RenestResult with the rewritten lines, dry-run listing and warnings
     """
-    with open(filepath, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    result = RenestResult()
     
     # Track nesting with a stack of tag names
     tag_stack: list[str] = []
-    output_lines: list[str] = []
-    xml_lines_output: list[str] = []
     
     for line_num, line in enumerate(lines, 1):
         if not is_xml_annotation_line(line):
-            output_lines.append(line)
+            result.lines.append(line)
             continue
         
         tag_name, is_closing = extract_tag_info(line)
@@ -106,7 +146,7 @@ def process_file(filepath: Path, dry_run: bool = False, preview: bool = False) -
         
         if tag_name is None or tag_content is None:
             # Couldn't parse, keep original
-            output_lines.append(line)
+            result.lines.append(line)
             continue
         
         if is_closing:
@@ -117,8 +157,8 @@ def process_file(filepath: Path, dry_run: bool = False, preview: bool = False) -
             if tag_stack and tag_stack[-1] == tag_name:
                 tag_stack.pop()
             else:
-                # Mismatched closing tag - emit warning but continue
-                print(f"Warning: Line {line_num}: Closing tag </{tag_name}> doesn't match expected </{tag_stack[-1] if tag_stack else 'none'}>", file=sys.stderr)
+                # Mismatched closing tag - record warning but continue
+                result.warnings.append(f"Warning: Line {line_num}: Closing tag </{tag_name}> doesn't match expected </{tag_stack[-1] if tag_stack else 'none'}>")
                 # Try to find and pop the matching tag
                 if tag_name in tag_stack:
                     idx = len(tag_stack) - 1 - tag_stack[::-1].index(tag_name)
@@ -128,19 +168,47 @@ def process_file(filepath: Path, dry_run: bool = False, preview: bool = False) -
             level = len(tag_stack) + 1
             tag_stack.append(tag_name)
         
-        # Generate the new line
+        # Generate the new line, keeping its original line ending
         prefix = format_nesting_prefix(level)
-        new_line = f"{prefix} {tag_content}\n"
+        ending = line[len(line.rstrip('\r\n')):] or '\n'
+        new_line = f"{prefix} {tag_content}{ending}"
         
-        output_lines.append(new_line)
-        xml_lines_output.append(f"L{line_num:4d} (depth={level}): {new_line.rstrip()}")
+        result.lines.append(new_line)
+        result.annotation_lines.append(f"L{line_num:4d} (depth={level}): {new_line.rstrip()}")
     
     # Check for unclosed tags
     if tag_stack:
-        print(f"Warning: Unclosed tags at end of file: {tag_stack}", file=sys.stderr)
+        result.unclosed = list(tag_stack)
+        result.warnings.append(f"Warning: Unclosed tags at end of file: {tag_stack}")
+    
+    return result
+
+
+def renest_text(text: str | bytes) -> RenestResult:
+    """Fix XML annotation nesting in an in-memory document."""
+    return renest_lines(split_lines(text))
+
+
+def process_file(filepath: Path, dry_run: bool = False, preview: bool = False) -> list[str]:
+    """Process a file and fix XML annotation nesting.
+    
+    Args:
+        filepath: Path to the file to process
+        dry_run: If True, only output XML lines to stdout
+        preview: If True, output full file with changes to stdout
+        
+    Returns:
+        List of processed lines
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        result = renest_lines(f)
+    output_lines = result.lines
+    
+    for warning in result.warnings:
+        print(warning, file=sys.stderr)
     
     if dry_run:
-        for xml_line in xml_lines_output:
+        for xml_line in result.annotation_lines:
             print(xml_line)
         return output_lines
     
@@ -153,7 +221,7 @@ def process_file(filepath: Path, dry_run: bool = False, preview: bool = False) -
     with open(filepath, 'w', encoding='utf-8') as f:
         f.writelines(output_lines)
     
-    print(f"Processed {len(xml_lines_output)} XML annotation lines in {filepath}")
+    print(f"Processed {len(result.annotation_lines)} XML annotation lines in {filepath}")
     return output_lines
 
 
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Property-based fuzz harness for the annotation scripts.
+
+Generates adversarial annotated markdown and checks, for every case:
+  - Renesting is idempotent: renest(renest(x)) == renest(x)
+  - Renesting never changes structure: parse(renest(x)) has the same tree
+    (tags, attributes, lines, sections, snippets) as parse(x)
+  - Parsing is lossless: parsed.text == the input text
+  - An unclosed leading "---" is a thematic break: it hides no annotations
+  - Incremental edits are exact: apply_edit() on random edits gives the
+    same nodes, spans, indexes, rollup and bundles as a full parse of the
+    edited text, and find_node() returns every node enclosing a line
+  - renest + parse + summary stay within a per-KB time budget, so a regex
+    that backtracks catastrophically fails here instead of in production
+
+Case generators:
+  balanced   - well-formed nested annotations with sections and prose
+  unbalanced - missing, extra and swapped closing tags
+  deep       - thousands of nesting levels
+  attributes - attribute strings packed with quotes and '='
+  no-close   - long lines of "`<tag" / "<tag" / "[" with no terminator
+  front-matter - front matter, an unclosed "---" or a prompt bundle first
+  mixed      - all of the above interleaved, with stale nesting prefixes
+
+Runs offline with the standard library only.
+
+Usage:
+    python fuzz_annotations.py                          # 200 cases, seed 0
+    python fuzz_annotations.py --iterations 2000 --seed 7
+    python fuzz_annotations.py --budget-ms-per-kb 2     # Tighter budget
+    python fuzz_annotations.py --kind deep              # One generator only
+    python fuzz_annotations.py --edits 20               # More edits per case
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from fix_xml_nesting import format_nesting_prefix, renest_text
+from generate_viz import (CATEGORY_FIELDS, ParsedAnnotations, apply_edit, find_node, generate_summary,
+                          parse_lines, parse_text)
+
+TAGS = [
+    'agent-identity', 'core-principles', 'guardrail', 'decision-framework',
+    'workflow', 'workflow-step', 'artifact-format', 'quality-gate',
+    'handoff-instruction', 'example', 'classification-logic',
+]
+SCOPES = ['reusable', 'phase-bound', 'workflow']
+PROSE = [
+    "Never fabricate information.",
+    "**Bold** text with a [link](https://example.com) inside.",
+    "- bullet item",
+    "",
+    "Text with <angle> brackets and a > quote",
+    "```markdown",
+    "```",
+]
+# Extra lines edits may insert: tags, sections, fences, bundles, front matter
+EDIT_LINES = [
+    "> `<guardrail scope=\"reusable\">`\n",
+    "> `</guardrail>`\n",
+    "<workflow-step>\n",
+    "</workflow-step>\n",
+    "## Edited Section\n",
+    "```\n",
+    "```chatagent\n",
+    "---\n",
+    "name: edited\n",
+    "new text line\n",
+    "\n",
+]
+
+
+def _open_tag(rng: random.Random, tag: str) -> str:
+    if rng.random() < 0.5:
+        return f'<{tag} scope="{rng.choice(SCOPES)}">'
+    return f'<{tag}>'
+
+
+def _tag_line(rng: random.Random, tag_text: str) -> str:
+    """An annotation line, sometimes with a stale or plain prefix."""
+    roll = rng.random()
+    if roll < 0.7:
+        return f"> `{tag_text}`"
+    if roll < 0.9:
+        return f"{format_nesting_prefix(rng.randint(1, 6))} `{tag_text}`"
+    return tag_text  # Plain XML form
+
+
+def gen_balanced(rng: random.Random, size: int) -> list[str]:
+    lines: list[str] = []
+    stack: list[str] = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.15 and len(stack) < 8:
+            tag = rng.choice(TAGS)
+            stack.append(tag)
+            lines.append(_tag_line(rng, _open_tag(rng, tag)))
+        elif roll < 0.3 and stack:
+            lines.append(_tag_line(rng, f"</{stack.pop()}>"))
+        elif roll < 0.35:
+            lines.append(f"## Section {rng.randint(1, 6)}")
+        else:
+            lines.append(rng.choice(PROSE))
+    while stack:
+        lines.append(_tag_line(rng, f"</{stack.pop()}>"))
+    return lines
+
+
+def gen_unbalanced(rng: random.Random, size: int) -> list[str]:
+    lines = gen_balanced(rng, size)
+    for _ in range(rng.randint(1, 5)):
+        closing = [i for i, line in enumerate(lines) if '</' in line]
+        if not closing:
+            break
+        i = rng.choice(closing)
+        roll = rng.random()
+        if roll < 0.4:
+            del lines[i]  # Missing close
+        elif roll < 0.7:
+            lines.insert(i, lines[i])  # Duplicate close
+        else:
+            j = rng.randrange(len(lines))
+            lines[i], lines[j] = lines[j], lines[i]  # Out of order
+    return lines
+
+
+def gen_deep(rng: random.Random, size: int) -> list[str]:
+    depth = rng.randint(size, size * 10)
+    tags = [rng.choice(TAGS) for _ in range(depth)]
+    lines = [_tag_line(rng, _open_tag(rng, tag)) for tag in tags]
+    lines.append("innermost content")
+    lines.extend(_tag_line(rng, f"</{tag}>") for tag in reversed(tags))
+    return lines
+
+
+def gen_attributes(rng: random.Random, size: int) -> list[str]:
+    lines = []
+    for _ in range(size // 10 + 1):
+        noise = ''.join(rng.choice(['"', "'", '=', 'a', ' ', 'scope', '\\'])
+                        for _ in range(rng.randint(10, 2000)))
+        tag = rng.choice(TAGS)
+        lines.append(f"> `<{tag} {noise}>`")
+        lines.append(rng.choice(PROSE))
+        lines.append(f"> `</{tag}>`")
+    return lines
+
+
+def gen_no_close(rng: random.Random, size: int) -> list[str]:
+    length = rng.randint(size * 100, size * 400)
+    pieces = ['`<a', '<a ', '`</', 'word', '[', '](', '**', '=', '"']
+    lines = []
+    for _ in range(rng.randint(1, 4)):
+        piece = rng.choice(pieces)
+        line = piece * (length // len(piece))
+        if rng.random() < 0.5:
+            line = "> " + line
+        lines.append(line)
+        # Long lines as content of a real annotation exercise the snippet path
+        lines.insert(0, "> `<guardrail>`")
+        lines.append("> `</guardrail>`")
+    return lines
+
+
+def gen_front_matter(rng: random.Random, size: int) -> list[str]:
+    body = gen_balanced(rng, size)
+    roll = rng.random()
+    if roll < 0.4:
+        return ["---", "name: fuzz", "description: |", "  folded text", "---"] + body
+    if roll < 0.7:
+        return ["---"] + body  # No closing line: a thematic break
+    metadata = ["---", "name: bundled"] + (["---"] if rng.random() < 0.5 else [])
+    return ["```chatagent"] + metadata + body + ["```"]
+
+
+def gen_mixed(rng: random.Random, size: int) -> list[str]:
+    lines = []
+    for _ in range(rng.randint(2, 5)):
+        kind = rng.choice([k for k in GENERATORS if k != 'mixed'])
+        lines.extend(GENERATORS[kind](rng, max(1, size // 4)))
+    return lines
+
+
+GENERATORS = {
+    'balanced': gen_balanced,
+    'unbalanced': gen_unbalanced,
+    'deep': gen_deep,
+    'attributes': gen_attributes,
+    'no-close': gen_no_close,
+    'front-matter': gen_front_matter,
+    'mixed': gen_mixed,
+}
+
+
+def tree_signature(parsed: ParsedAnnotations) -> list[tuple]:
+    """Structure of a parse, independent of nesting prefixes (iterative)."""
+    return [
+        (node.tag, sorted(node.attributes.items()), node.line_number, node.end_line,
+         node.section, node.content_snippet, [child.line_number for child in node.children])
+        for node in parsed.nodes
+    ]
+
+
+def parse_signature(parsed: ParsedAnnotations) -> tuple:
+    """Everything a parse exposes, for comparing incremental and full parses."""
+    nodes = [
+        (node.tag, node.attributes, node.scope, node.section, node.content_snippet, node.line_number,
+         node.end_line, node.prefix, node.fence, node.open_text, node.close_text, node.start_offset,
+         node.body_start_offset, node.body_end_offset, node.end_offset,
+         [child.line_number for child in node.children])
+        for node in parsed.nodes
+    ]
+    return (
+        parsed.agent_name, parsed.front_matter, parsed.source_lines, parsed.line_offsets, nodes,
+        [node.line_number for node in parsed.root_nodes],
+        {category: [node.line_number for node in getattr(parsed, category)]
+         for category in sorted(set(CATEGORY_FIELDS.values()))},
+        list(parsed.tag_sections.items()),
+        [(section, [(tag, node.line_number) for tag, node in entries])
+         for section, entries in parsed.section_tags.items()],
+        parsed.rollup,
+        [(bundle.kind, bundle.metadata, bundle.start_line, bundle.end_line) for bundle in parsed.bundles],
+    )
+
+
+def random_edit(rng: random.Random, parsed: ParsedAnnotations) -> tuple[int, int, list[str]]:
+    """A (first_line, last_line, new_lines) edit, usually inside an annotation."""
+    line_count = len(parsed.source_lines)
+    if parsed.nodes and rng.random() < 0.8:
+        node = rng.choice(parsed.nodes)
+        first = rng.randint(node.line_number, parsed.end_line_of(node))
+    else:
+        first = rng.randint(1, line_count + 1)
+    last = min(line_count, first + rng.randint(-1, 3))  # first - 1 inserts
+    pool = EDIT_LINES + parsed.source_lines[max(0, first - 5):first + 5]
+    return first, last, [rng.choice(pool) for _ in range(rng.randint(0, 4))]
+
+
+def check_edits(rng: random.Random, text: str, edits: int):
+    """Check apply_edit() and find_node() against full parses.
+
+    Raises:
+        AssertionError: If an incremental result differs from a full parse
+    """
+    parsed = parse_text(text)
+    for _ in range(edits):
+        first, last, new_lines = random_edit(rng, parsed)
+        source = parsed.source_lines
+        edited = source[:first - 1] + new_lines + source[max(last, first - 1):]
+        parsed = apply_edit(parsed, first, last, new_lines)
+        expected = parse_lines(edited)
+        assert parse_signature(parsed) == parse_signature(expected), \
+            f"apply_edit({first}, {last}, {new_lines!r}) differs from a full parse"
+
+        line = rng.randint(1, max(1, len(edited)))
+        enclosing = [node for node in parsed.nodes
+                     if node.line_number <= line <= parsed.end_line_of(node)]
+        assert find_node(parsed, line) == enclosing, f"find_node({line}) missed an enclosing node"
+
+
+def check_case(text: str) -> float:
+    """Check properties for one document; returns elapsed seconds.
+
+    Raises:
+        AssertionError: If a property does not hold
+    """
+    start = time.perf_counter()
+    renested = renest_text(text)
+    parsed = parse_text(renested.text)
+    generate_summary(parsed)
+    elapsed = time.perf_counter() - start
+
+    assert renest_text(renested.text).text == renested.text, "renest is not idempotent"
+    assert parsed.text == renested.text, "parse is not lossless"
+    original = parse_text(text)
+    assert tree_signature(original) == tree_signature(parsed), "renest changed the parse tree"
+
+    lines = renested.lines
+    if lines and lines[0].strip() == '---' and not any(line.strip() == '---' for line in lines[1:]):
+        tags = [(node.tag, node.attributes) for node in parse_lines(lines[1:]).nodes]
+        assert tags == [(node.tag, node.attributes) for node in parsed.nodes], \
+            "unclosed front matter hid annotations"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fuzz the annotation parser and nesting fixer.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('--iterations', '-n', type=int, default=200, help='Number of cases (default: 200)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--size', type=int, default=200, help='Approximate lines per case (default: 200)')
+    parser.add_argument('--budget-ms-per-kb', type=float, default=3.0,
+                        help='Max renest+parse+summary time per KB of input (default: 3.0)')
+    parser.add_argument('--kind', choices=sorted(GENERATORS), help='Only run one generator')
+    parser.add_argument('--edits', type=int, default=3,
+                        help='Random apply_edit() checks per case (default: 3)')
+
+    args = parser.parse_args()
+
+    kinds = [args.kind] if args.kind else list(GENERATORS)
+    # Worst observed ms/KB per generator: kind -> (ms_per_kb, case_seed, kb)
+    worst: dict[str, tuple[float, int, float]] = {}
+    total_kb = 0.0
+
+    for i in range(args.iterations):
+        case_seed = args.seed * 1_000_003 + i
+        rng = random.Random(case_seed)
+        kind = kinds[i % len(kinds)]
+        text = '\n'.join(GENERATORS[kind](rng, args.size)) + '\n'
+        kb = len(text.encode('utf-8')) / 1024
+        total_kb += kb
+
+        try:
+            elapsed = check_case(text)
+            check_edits(rng, text, args.edits)
+        except AssertionError as e:
+            print(f"FAIL [{kind}] case seed {case_seed}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        # Small inputs are dominated by fixed overhead; charge at least 1 KB
+        ms_per_kb = elapsed * 1000 / max(kb, 1.0)
+        if kind not in worst or ms_per_kb > worst[kind][0]:
+            worst[kind] = (ms_per_kb, case_seed, kb)
+        if ms_per_kb > args.budget_ms_per_kb:
+            print(f"FAIL [{kind}] case seed {case_seed}: {ms_per_kb:.2f} ms/KB on {kb:.1f} KB "
+                  f"exceeds budget of {args.budget_ms_per_kb} ms/KB", file=sys.stderr)
+            sys.exit(1)
+
+    print(f"{args.iterations} cases, {total_kb:.0f} KB, all properties hold")
+    print("worst case per generator:")
+    for kind, (ms_per_kb, case_seed, kb) in sorted(worst.items()):
+        print(f"  {kind:<12} {ms_per_kb:6.2f} ms/KB  ({kb:.1f} KB, seed {case_seed})")
+
+
+if __name__ == '__main__':
+    main()
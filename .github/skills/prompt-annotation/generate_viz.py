@@ -16,6 +16,18 @@ Usage:
     python generate_viz.py <file.md> --summary         # Print only YAML summary
     python generate_viz.py <file.md> --output <dir>    # Write files to directory
 
+Input formats (one linear scan handles all of them):
+  - YAML front matter (agents/*.agent.md, skills/*/SKILL.md); `name:` is
+    used as the agent name, falling back to the file name
+  - Blockquote tags: > `<tag>` (recognized anywhere)
+  - Plain tag lines: <tag> (outside code fences, or inside prompt bundles)
+  - Prompt bundles: fenced ````chatagent / chatmode / prompt blocks, with
+    their own front matter
+
+Library use (no file I/O):
+    from generate_viz import parse_text, generate_all
+    outputs = generate_all(parse_text(text, agent_name="PAW"))
+
 Markmap output can be viewed with:
   - VS Code extension: markmap.markmap-vscode
   - CLI: npx markmap-cli <file>.mm.md -o <file>.html
@@ -23,45 +35,365 @@ Markmap output can be viewed with:
 """
 
 import argparse
+import bisect
 import re
 import sys
+from collections import Counter
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional, Sequence
+
+from fix_xml_nesting import TAG_CONTENT_RE, TAG_RE, split_lines
+
+# Backticked tags use the linear-time TAG_RE/TAG_CONTENT_RE from
+# fix_xml_nesting. The plain patterns follow the same rules: the name can't
+# backtrack ((?![\w-])) and the plain form is only searched up to the last
+# ">" on the line.
+PLAIN_TAG_RE = re.compile(r'<(/?)([a-zA-Z][\w-]*)(?![\w-])([^>]*)>')
+PLAIN_TAG_LINE_RE = re.compile(r'^</?[a-zA-Z][^>]*>\s*$')
+# A whole line that is one plain tag, capturing like TAG_RE
+PLAIN_TAG_ONLY_RE = re.compile(r'^\s*<(/?)([a-zA-Z][\w-]*)(?![\w-])([^>]*)>\s*$')
+FRONT_MATTER_KEY_RE = re.compile(r'^([A-Za-z_][\w-]*):(?:\s+(.*?))?\s*$')
+
+# Directories never searched for markdown
+SKIP_DIRS = {'.git', 'node_modules', 'out', 'dist', '.vscode-test'}
+
+# Fence languages whose content is itself an agent/prompt file
+BUNDLE_LANGUAGES = {'chatagent', 'chatmode', 'prompt', 'instructions'}
+ATTRIBUTE_RE = re.compile(r'(?<!\w)(\w+)=["\']([^"\']*)["\']')
+BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+# Link text may not contain brackets, so runs of "[" don't rescan the line
+LINK_RE = re.compile(r'\[([^\[\]]+)\]\([^)]+\)')
 
 
 @dataclass
 class AnnotationNode:
-    """Represents an annotation tag with its content and children."""
+    """Represents an annotation tag with its content and children.
+    
+    Positions (line_number, end_line and the byte offsets) are stored
+    relative to the parent node and resolved on access, so an edit only
+    moves the edited node's later siblings and its ancestors.
+    """
     tag: str
     attributes: dict = field(default_factory=dict)
     content_snippet: str = ""
     children: list = field(default_factory=list)
     scope: Optional[str] = None
     section: str = ""  # Document section (## header) where this annotation appears
-    line_number: int = 0  # Line number in source file
+    prefix: str = ""  # Original text before the tag on the opening line (e.g. ">- ")
+    fence: str = ""  # Opening line of the code fence enclosing the tag ("" if none)
+    open_text: str = ""  # Opening tag line, verbatim
+    close_text: str = ""  # Closing tag line, verbatim ("" if never closed)
+    # Enclosing node (None for roots), and the opening line and start offset
+    # relative to its start (absolute for roots)
+    _parent: Optional['AnnotationNode'] = field(default=None, repr=False, compare=False)
+    _line: int = field(default=0, repr=False)
+    _offset: int = field(default=0, repr=False)
+    # Lines to the closing tag (0 if never closed), and byte lengths from the
+    # start to the body start, body end and end
+    _lines: int = field(default=0, repr=False)
+    _body_start: int = field(default=0, repr=False)
+    _body_end: int = field(default=0, repr=False)
+    _end: int = field(default=0, repr=False)
+    # Layout version shared by all nodes of a parse (bumped by apply_edit),
+    # and (version, line_number, start_offset) as last resolved
+    _layout: list = field(default_factory=lambda: [0], repr=False, compare=False)
+    _resolved: tuple = field(default=(-1, 0, 0), repr=False, compare=False)
     
     def add_child(self, child: 'AnnotationNode'):
         self.children.append(child)
+    
+    @property
+    def line_number(self) -> int:
+        """Line number of the opening tag (1-based)."""
+        return self._position()[0]
+    
+    @property
+    def end_line(self) -> int:
+        """Line number of the closing tag (0 if never closed)."""
+        return self._position()[0] + self._lines if self._lines else 0
+    
+    # UTF-8 byte offsets into the source; body is the text between the tag lines.
+    # Unclosed nodes extend to end of file.
+    @property
+    def start_offset(self) -> int:
+        return self._position()[1]
+    
+    @property
+    def body_start_offset(self) -> int:
+        return self._position()[1] + self._body_start
+    
+    @property
+    def body_end_offset(self) -> int:
+        return self._position()[1] + self._body_end
+    
+    @property
+    def end_offset(self) -> int:
+        return self._position()[1] + self._end
+    
+    @property
+    def body_lines(self) -> tuple[int, int]:
+        """1-based inclusive (first, last) body line range; empty if last < first.
+        
+        For unclosed nodes the last line is 0; use ParsedAnnotations.end_line_of().
+        """
+        return self.line_number + 1, self.end_line - 1 if self.end_line else 0
+    
+    def _place(self, parent: Optional['AnnotationNode'], layout: list, line_number: int,
+               start_offset: int):
+        """Attach to parent (None for a root) at absolute positions."""
+        base_line, base_offset = parent._position() if parent is not None else (0, 0)
+        self._parent = parent
+        self._layout = layout
+        self._line = line_number - base_line
+        self._offset = start_offset - base_offset
+        self._resolved = (layout[0], line_number, start_offset)
+    
+    def _position(self) -> tuple[int, int]:
+        """Absolute (line_number, start_offset), resolved through the parents.
+        
+        Climbs only to the nearest ancestor resolved under the current
+        layout version, so a walk over the tree is linear overall.
+        """
+        version = self._layout[0]
+        if self._resolved[0] == version:
+            return self._resolved[1], self._resolved[2]
+        chain = []
+        node = self
+        while node is not None and node._resolved[0] != version:
+            chain.append(node)
+            node = node._parent
+        line, offset = (node._resolved[1], node._resolved[2]) if node is not None else (0, 0)
+        for node in reversed(chain):
+            line += node._line
+            offset += node._offset
+            node._resolved = (version, line, offset)
+        return line, offset
+
+
+# Tag name -> ParsedAnnotations category list it is collected into
+CATEGORY_FIELDS = {
+    'workflow-step': 'workflow_steps',
+    'handoff-instruction': 'handoffs',
+    'guardrail': 'guardrails',
+    'decision-framework': 'decision_frameworks',
+    'artifact-format': 'artifacts',
+    'artifact': 'artifacts',
+    'quality-gate': 'quality_gates',
+}
 
 
 @dataclass
-class ParsedAnnotations:
-    """Container for all parsed annotation data."""
-    root_nodes: list[AnnotationNode] = field(default_factory=list)
-    workflow_steps: list[AnnotationNode] = field(default_factory=list)
-    handoffs: list[AnnotationNode] = field(default_factory=list)
-    guardrails: list[AnnotationNode] = field(default_factory=list)
-    decision_frameworks: list[AnnotationNode] = field(default_factory=list)
-    artifacts: list[AnnotationNode] = field(default_factory=list)
-    quality_gates: list[AnnotationNode] = field(default_factory=list)
-    agent_name: str = "Agent"
+class AnnotationRollup:
+    """Annotation counts, maintained while parsing.
+    
+    Rollups from many files can be merged for corpus-level totals without
+    keeping their trees around.
+    """
+    tags: Counter = field(default_factory=Counter)  # tag -> count
+    scopes: Counter = field(default_factory=Counter)  # scope ("unspecified" if none) -> count
+    sections: Counter = field(default_factory=Counter)  # section -> annotation count
+    tag_sections: Counter = field(default_factory=Counter)  # (tag, section) -> count
+    # scope -> count over the categorized tags (guardrails, workflow steps, ...)
+    category_scopes: Counter = field(default_factory=Counter)
+    
+    def add(self, node: AnnotationNode, count: int = 1):
+        """Count a node (use count=-1 to remove one)."""
+        scope = node.scope or 'unspecified'
+        _bump(self.tags, node.tag, count)
+        _bump(self.scopes, scope, count)
+        _bump(self.sections, node.section, count)
+        _bump(self.tag_sections, (node.tag, node.section), count)
+        if node.tag in CATEGORY_FIELDS:
+            _bump(self.category_scopes, scope, count)
+    
+    def merge(self, other: 'AnnotationRollup') -> 'AnnotationRollup':
+        """Add another rollup's counts into this one; returns self."""
+        self.tags.update(other.tags)
+        self.scopes.update(other.scopes)
+        self.sections.update(other.sections)
+        self.tag_sections.update(other.tag_sections)
+        self.category_scopes.update(other.category_scopes)
+        return self
+    
+    @classmethod
+    def combine(cls, rollups: Iterable['AnnotationRollup']) -> 'AnnotationRollup':
+        """Merge many rollups (e.g. one per file) into a new one."""
+        total = cls()
+        for rollup in rollups:
+            total.merge(rollup)
+        return total
+
+
+@dataclass
+class PromptBundle:
+    """A fenced agent/prompt file embedded in markdown (e.g. ````chatagent)."""
+    kind: str  # Fence language: chatagent, chatmode, prompt, ...
+    metadata: dict = field(default_factory=dict)  # The bundle's front matter
+    # Fence lines as marks on nearby nodes (see _mark), so edits elsewhere
+    # move them without rewriting
+    _start: tuple = field(default=(None, False, 0), repr=False, compare=False)
+    _end: Optional[tuple] = field(default=None, repr=False, compare=False)
+    
+    @property
+    def start_line(self) -> int:
+        """Opening fence line."""
+        return _resolve_mark(self._start)
+    
+    @property
+    def end_line(self) -> int:
+        """Closing fence line (0 if never closed)."""
+        return _resolve_mark(self._end) if self._end else 0
+
+
+def _mark(parent: Optional[AnnotationNode], siblings: list[AnnotationNode],
+          line_number: int) -> tuple:
+    """A line position as (anchor node, relative to its end?, line delta).
+    
+    Anchors on the end of the last (closed) node before the line at its
+    level, else on the start of the enclosing node, so it moves with them.
+    """
+    if siblings:
+        return siblings[-1], True, line_number - siblings[-1].end_line
+    if parent is not None:
+        return parent, False, line_number - parent.line_number
+    return None, False, line_number
+
+
+def _resolve_mark(mark: tuple) -> int:
+    anchor, from_end, delta = mark
+    if anchor is None:
+        return delta
+    return (anchor.end_line if from_end else anchor.line_number) + delta
+
+
+def _bump(counter: Counter, key, count: int):
+    """Adjust a count, dropping keys that reach zero."""
+    counter[key] += count
+    if counter[key] <= 0:
+        del counter[key]
+
+
+@dataclass
+class _NodeIndex:
+    """Views over a parse tree, rebuilt on first use after a parse or edit."""
+    version: int
+    # Every node in document order (parents before children)
+    nodes: list[AnnotationNode] = field(default_factory=list)
+    # ParsedAnnotations category list name -> nodes
+    categories: dict = field(default_factory=lambda: {name: [] for name in CATEGORY_FIELDS.values()})
     # Maps tag type -> list of sections where it appears
     tag_sections: dict = field(default_factory=dict)
     # Maps section name -> list of (tag, node) tuples
     section_tags: dict = field(default_factory=dict)
 
 
+@dataclass
+class ParsedAnnotations:
+    """Container for all parsed annotation data.
+    
+    The tree (root_nodes), bundles and rollup are kept up to date by
+    apply_edit(); node lists and section indexes are derived from the tree
+    when first read.
+    """
+    root_nodes: list[AnnotationNode] = field(default_factory=list)
+    agent_name: str = "Agent"
+    # Name supplied by the caller (e.g. from the file name); agent_name
+    # prefers the front matter's name: field over it
+    source_name: str = "Agent"
+    # Document front matter (name, description, ...), read during the parse
+    front_matter: dict = field(default_factory=dict)
+    # Embedded prompt bundles in document order
+    bundles: list[PromptBundle] = field(default_factory=list)
+    # Per-tag, per-scope, per-section and per-(tag, section) counts
+    rollup: AnnotationRollup = field(default_factory=AnnotationRollup)
+    # Lossless source: ''.join(source_lines) reproduces the input exactly
+    source_lines: list[str] = field(default_factory=list, repr=False)
+    # Layout version shared with the nodes; bumped by apply_edit()
+    _layout: list = field(default_factory=lambda: [0], repr=False, compare=False)
+    _index: Optional[_NodeIndex] = field(default=None, repr=False, compare=False)
+    # (layout version, line offsets) as last computed
+    _offsets: tuple = field(default=(-1, []), repr=False, compare=False)
+    
+    def _indexed(self) -> _NodeIndex:
+        """Node lists and section indexes for the current tree."""
+        index = self._index
+        if index is not None and index.version == self._layout[0]:
+            return index
+        index = _NodeIndex(self._layout[0])
+        for node, _ in walk_subtree(self.root_nodes):
+            index.nodes.append(node)
+            category = CATEGORY_FIELDS.get(node.tag)
+            if category:
+                index.categories[category].append(node)
+            sections = index.tag_sections.setdefault(node.tag, [])
+            if node.section not in sections:
+                sections.append(node.section)
+            index.section_tags.setdefault(node.section, []).append((node.tag, node))
+        self._index = index
+        return index
+    
+    @property
+    def nodes(self) -> list[AnnotationNode]:
+        """Every node in document order (parents before children)."""
+        return self._indexed().nodes
+    
+    @property
+    def workflow_steps(self) -> list[AnnotationNode]:
+        return self._indexed().categories['workflow_steps']
+    
+    @property
+    def handoffs(self) -> list[AnnotationNode]:
+        return self._indexed().categories['handoffs']
+    
+    @property
+    def guardrails(self) -> list[AnnotationNode]:
+        return self._indexed().categories['guardrails']
+    
+    @property
+    def decision_frameworks(self) -> list[AnnotationNode]:
+        return self._indexed().categories['decision_frameworks']
+    
+    @property
+    def artifacts(self) -> list[AnnotationNode]:
+        return self._indexed().categories['artifacts']
+    
+    @property
+    def quality_gates(self) -> list[AnnotationNode]:
+        return self._indexed().categories['quality_gates']
+    
+    @property
+    def tag_sections(self) -> dict:
+        """Maps tag type -> list of sections where it appears."""
+        return self._indexed().tag_sections
+    
+    @property
+    def section_tags(self) -> dict:
+        """Maps section name -> list of (tag, node) tuples."""
+        return self._indexed().section_tags
+    
+    @property
+    def line_offsets(self) -> list[int]:
+        """line_offsets[i] is the byte offset of source_lines[i]; last entry is total size."""
+        version, offsets = self._offsets
+        if version != self._layout[0]:
+            offsets = _line_offsets(self.source_lines)
+            self._offsets = (self._layout[0], offsets)
+        return offsets
+    
+    @property
+    def text(self) -> str:
+        return ''.join(self.source_lines)
+    
+    def end_line_of(self, node: AnnotationNode) -> int:
+        """Closing line of a node, or the last line of the file if unclosed."""
+        return node.end_line or len(self.source_lines)
+    
+    def node_text(self, node: AnnotationNode) -> str:
+        """Source text of a node including its opening and closing lines."""
+        return ''.join(self.source_lines[node.line_number - 1:self.end_line_of(node)])
+
+
 def extract_tag_info(line: str) -> tuple[Optional[str], bool, dict]:
     """Extract tag name, closing status, and attributes from a line.
     
@@ -73,22 +405,44 @@ def extract_tag_info(line: str) -> tuple[Optional[str], bool, dict]:
     
     Returns (tag_name, is_closing, attributes) or (None, False, {}) if no tag.
     """
+    match = _match_tag(line)
+    if not match:
+        return None, False, {}
+    return _tag_info(match)
+
+
+def _match_tag(line: str) -> Optional[re.Match]:
+    """Find the annotation tag on a line (blockquote form first, then plain)."""
     # Try blockquote format first: > `<tag>`
-    match = re.search(r'`<(/?)([a-zA-Z][\w-]*)([^>]*)>`', line)
+    match = TAG_RE.search(line)
     if not match:
         # Try plain XML format: <tag> or </tag>
-        match = re.search(r'<(/?)([a-zA-Z][\w-]*)([^>]*)>', line)
-    
-    if not match:
-        return None, False, {}
+        match = PLAIN_TAG_RE.search(line, 0, line.rfind('>') + 1)
+    return match
+
+
+def _match_annotation(line: str, plain: bool) -> Optional[re.Match]:
+    """Match an annotation line in one step (see is_annotation_line).
     
+    Blockquote lines must hold a backticked tag; other lines count only when
+    plain is True and the whole line is a single tag.
+    """
+    if line.lstrip().startswith('>'):
+        return TAG_RE.search(line)
+    if plain:
+        return PLAIN_TAG_ONLY_RE.match(line)
+    return None
+
+
+def _tag_info(match: re.Match) -> tuple[str, bool, dict]:
+    """Tag name, closing status, and attributes from a _match_tag() match."""
     is_closing = match.group(1) == '/'
     tag_name = match.group(2)
     attr_string = match.group(3).strip()
     
     # Parse attributes
     attributes = {}
-    for attr_match in re.finditer(r'(\w+)=["\']([^"\']*)["\']', attr_string):
+    for attr_match in ATTRIBUTE_RE.finditer(attr_string):
         attributes[attr_match.group(1)] = attr_match.group(2)
     
     return tag_name, is_closing, attributes
@@ -100,11 +454,11 @@ def is_annotation_line(line: str) -> bool:
     
     # Blockquote format: > `<tag>`
     if stripped.startswith('>'):
-        return bool(re.search(r'`</?[a-zA-Z][\w-]*[^>]*>`', line))
+        return bool(TAG_CONTENT_RE.search(line))
     
     # Plain XML format (for lines inside code blocks or raw): <tag>
     # Must be a standalone tag line, not prose with angle brackets
-    if re.match(r'^</?[a-zA-Z][\w-]*[^>]*>\s*$', stripped):
+    if PLAIN_TAG_LINE_RE.match(stripped):
         return True
     
     return False
@@ -127,8 +481,9 @@ def extract_content_snippet(lines: list[str], start_idx: int, max_chars: int = 5
             continue
         
         # Clean up the line
-        clean = re.sub(r'\*\*([^*]+)\*\*', r'\1', line)  # Remove bold
-        clean = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', clean)  # Remove links
+        clean = BOLD_RE.sub(r'\1', line)  # Remove bold
+        if '](' in clean:
+            clean = _strip_links(clean)  # Remove links
         clean = clean.strip()
         
         if clean:
@@ -143,39 +498,161 @@ def extract_content_snippet(lines: list[str], start_idx: int, max_chars: int = 5
     return snippet
 
 
+def _strip_links(text: str) -> str:
+    """Replace markdown links with their text, scanning only up to the last ")"."""
+    end = text.rfind(')') + 1
+    return LINK_RE.sub(r'\1', text[:end]) + text[end:]
+
+
 def parse_annotations(filepath: Path) -> ParsedAnnotations:
-    """Parse an annotated markdown file into structured data."""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    """Parse an annotated markdown file into structured data.
     
-    result = ParsedAnnotations()
+    Line endings are kept as in the file, so node byte offsets match it.
+    """
+    with open(filepath, 'r', encoding='utf-8', newline='') as f:
+        lines = f.readlines()
     
     # Try to extract agent name from filename or content
-    result.agent_name = filepath.stem.replace('.agent', '').replace('-', ' ')
+    return parse_lines(lines, agent_name=filepath.stem.replace('.agent', '').replace('-', ' '))
+
+
+def find_markdown(paths: Sequence[Path]) -> list[Path]:
+    """All markdown files under paths, sorted, skipping build/vendor dirs."""
+    files = set()
+    for path in paths:
+        if path.is_file():
+            files.add(path)
+            continue
+        for candidate in path.rglob('*.md'):
+            if not SKIP_DIRS.intersection(candidate.parts):
+                files.add(candidate)
+    return sorted(files)
+
+
+def parse_text(text: str | bytes, agent_name: str = "Agent") -> ParsedAnnotations:
+    """Parse an in-memory annotated markdown document."""
+    return parse_lines(split_lines(text), agent_name=agent_name)
+
+
+def parse_lines(lines: Sequence[str], agent_name: str = "Agent") -> ParsedAnnotations:
+    """Parse already-split lines of an annotated markdown document.
     
+    Callers holding a list (e.g. renest output) can parse it without
+    re-joining or re-splitting the text. The list itself is copied
+    (shallowly), so the result owns source_lines and apply_edit() never
+    changes the caller's list.
+    """
+    lines = list(lines)
+    result = ParsedAnnotations(agent_name=agent_name, source_name=agent_name, source_lines=lines)
+    result._offsets = (result._layout[0], _line_offsets(lines))
+    _parse_region(result, lines, result.line_offsets, "(preamble)", at_document_start=True)
+    name = result.front_matter.get('name')
+    if isinstance(name, str) and name:
+        result.agent_name = name
+    return result
+
+
+def _line_offsets(lines: Sequence[str], start: int = 0) -> list[int]:
+    """UTF-8 byte offset of each line, plus the end offset."""
+    offsets = [start]
+    total = start
+    for line in lines:
+        total += len(line) if line.isascii() else len(line.encode('utf-8'))
+        offsets.append(total)
+    return offsets
+
+
+def _parse_region(result: ParsedAnnotations, lines: Sequence[str], offsets: list[int],
+                  current_section: str, line_base: int = 0, fence: str = "",
+                  at_document_start: bool = False) -> tuple[str, str, bool]:
+    """Parse lines into result's tree, bundles and rollup, in document order.
+    
+    One pass reads front matter, code fences, prompt bundles, section
+    headers and both tag syntaxes.
+    
+    Args:
+        result: Container to add nodes, bundles and counts to
+        lines: Lines to parse (a whole file or one node's region)
+        offsets: Byte offsets for lines (len(lines) + 1 entries)
+        current_section: Section in effect before the first line
+        line_base: 0-based index of lines[0] in the full source
+        fence: Code fence open before the first line ("" if none)
+        at_document_start: Whether lines[0] may open the document front matter
+        
+    Returns:
+        (section, fence) in effect after the last line, and whether a fence
+        open before the first line was closed within the lines
+    """
     # Stack for building tree: list of (node, tag_name)
     node_stack: list[tuple[AnnotationNode, str]] = []
     
-    # Track current document section (## headers)
-    current_section = "(preamble)"
+    # Front matter being read (a dict to fill), or expected on the next line
+    front_matter: Optional[dict] = None
+    front_matter_key: Optional[str] = None
+    expect_front_matter: Optional[dict] = result.front_matter if at_document_start else None
+    bundle: Optional[PromptBundle] = None
+    closed_outer_fence = False
+    plain_tags = not fence or _fence_language(fence) in BUNDLE_LANGUAGES
     
     for i, line in enumerate(lines):
+        if front_matter is not None:
+            if line.strip() == '---':
+                front_matter = None
+            else:
+                front_matter_key = _read_front_matter_line(line, front_matter, front_matter_key)
+            continue
+        if expect_front_matter is not None:
+            target, expect_front_matter = expect_front_matter, None
+            # Without a closing "---" the line is just a thematic break
+            if line.strip() == '---' and _closes_front_matter(lines, i + 1, fence):
+                front_matter, front_matter_key = target, None
+                continue
+        
+        # Code fences: plain tags inside ordinary fences are examples, but
+        # a prompt bundle's body is a prompt in its own right
+        stripped = line.strip()
+        if stripped.startswith(('```', '~~~')):
+            if not fence:
+                fence = stripped
+                language = _fence_language(fence)
+                plain_tags = language in BUNDLE_LANGUAGES
+                if plain_tags:
+                    bundle = PromptBundle(kind=language,
+                                          _start=_mark(*_insertion_point(result, node_stack), line_base + i + 1))
+                    result.bundles.append(bundle)
+                    expect_front_matter = bundle.metadata
+                    if line_base + i == 0 and at_document_start:
+                        # Whole file wrapped in a bundle: its metadata is the document's
+                        result.front_matter = bundle.metadata
+                continue
+            if _closes_fence(stripped, fence):
+                if bundle is not None:
+                    bundle._end = _mark(*_insertion_point(result, node_stack), line_base + i + 1)
+                    bundle = None
+                else:
+                    closed_outer_fence = True
+                fence = ""
+                plain_tags = True
+                continue
+        
         # Track section headers
         if line.startswith('## '):
             current_section = line[3:].strip()
             continue
         
-        if not is_annotation_line(line):
-            continue
-        
-        tag_name, is_closing, attributes = extract_tag_info(line)
-        if tag_name is None:
+        match = _match_annotation(line, plain_tags)
+        if match is None:
             continue
+        tag_name, is_closing, attributes = _tag_info(match)
         
         if is_closing:
             # Pop matching node from stack
             if node_stack and node_stack[-1][1] == tag_name:
-                node_stack.pop()
+                node = node_stack.pop()[0]
+                node._lines = line_base + i + 1 - node.line_number
+                node.close_text = line
+                node._body_end = offsets[i] - node.start_offset
+                node._end = offsets[i + 1] - node.start_offset
         else:
             # Create new node with section tracking
             node = AnnotationNode(
@@ -184,74 +661,311 @@ def parse_annotations(filepath: Path) -> ParsedAnnotations:
                 scope=attributes.get('scope'),
                 content_snippet=extract_content_snippet(lines, i),
                 section=current_section,
-                line_number=i + 1  # 1-based line numbers
+                prefix=_tag_prefix(line, match),
+                fence=fence,
+                open_text=line,
+                _body_start=offsets[i + 1] - offsets[i],
+                # Until closed, the node extends to the end of the lines
+                _body_end=offsets[-1] - offsets[i],
+                _end=offsets[-1] - offsets[i],
             )
+            result.rollup.add(node)
             
-            # Track tag -> sections mapping
-            if tag_name not in result.tag_sections:
-                result.tag_sections[tag_name] = []
-            if current_section not in result.tag_sections[tag_name]:
-                result.tag_sections[tag_name].append(current_section)
-            
-            # Track section -> tags mapping
-            if current_section not in result.section_tags:
-                result.section_tags[current_section] = []
-            result.section_tags[current_section].append((tag_name, node))
-            
-            # Add to parent or root
-            if node_stack:
-                node_stack[-1][0].add_child(node)
+            # Add to parent or root (section and category indexes are
+            # derived from the tree on first use)
+            parent = node_stack[-1][0] if node_stack else None
+            node._place(parent, result._layout, line_base + i + 1, offsets[i])  # 1-based line numbers
+            if parent is not None:
+                parent.add_child(node)
             else:
                 result.root_nodes.append(node)
             
             # Push onto stack
             node_stack.append((node, tag_name))
-            
-            # Categorize by tag type
-            if tag_name == 'workflow-step':
-                result.workflow_steps.append(node)
-            elif tag_name == 'handoff-instruction':
-                result.handoffs.append(node)
-            elif tag_name == 'guardrail':
-                result.guardrails.append(node)
-            elif tag_name == 'decision-framework':
-                result.decision_frameworks.append(node)
-            elif tag_name in ('artifact-format', 'artifact'):
-                result.artifacts.append(node)
-            elif tag_name == 'quality-gate':
-                result.quality_gates.append(node)
     
-    return result
+    return current_section, fence, closed_outer_fence
 
 
-def generate_mindmap(parsed: ParsedAnnotations) -> str:
-    """Generate Mermaid mindmap from parsed annotations."""
-    lines = ["```mermaid", "mindmap", f"  root(({parsed.agent_name}))"]
+def _insertion_point(result: ParsedAnnotations,
+                     node_stack: list[tuple[AnnotationNode, str]]) -> tuple[Optional[AnnotationNode], list]:
+    """(enclosing node, its children so far) for the line being parsed."""
+    if node_stack:
+        parent = node_stack[-1][0]
+        return parent, parent.children
+    return None, result.root_nodes
+
+
+def _tag_prefix(line: str, match: re.Match) -> str:
+    """Text before the tag (and its backtick) on a line."""
+    if match.re is TAG_RE:
+        return line[:match.start()]
+    return line[:match.start(1) - 1]  # Plain tag: up to the "<"
+
+
+def _fence_language(fence: str) -> str:
+    """Language (first word of the info string) of a fence opening line."""
+    info = fence.lstrip(fence[0]).strip()
+    return info.split()[0].lower() if info else ""
+
+
+def _closes_fence(stripped: str, fence: str) -> bool:
+    """Whether a stripped line closes the fence opened by fence (CommonMark rules)."""
+    char = fence[0]
+    opening_length = len(fence) - len(fence.lstrip(char))
+    return len(stripped) >= opening_length and stripped == char * len(stripped)
+
+
+def _closes_front_matter(lines: Sequence[str], start: int, fence: str) -> bool:
+    """Whether a "---" line at or after lines[start] closes front matter.
     
-    def render_node(node: AnnotationNode, depth: int):
-        indent = "    " * depth
-        
-        # Format node label
-        label = node.tag
-        if node.content_snippet:
-            # Truncate and escape for mermaid
-            snippet = node.content_snippet[:30]
-            if len(node.content_snippet) > 30:
-                snippet += "..."
-            snippet = snippet.replace('"', "'").replace('(', '[').replace(')', ']')
-            label = f"{node.tag}: {snippet}"
+    Inside a prompt bundle the block must close before the bundle's fence.
+    """
+    for i in range(start, len(lines)):
+        stripped = lines[i].strip()
+        if stripped == '---':
+            return True
+        if fence and _closes_fence(stripped, fence):
+            return False
+    return False
+
+
+def _read_front_matter_line(line: str, metadata: dict, key: Optional[str]) -> Optional[str]:
+    """Read one front matter line into metadata; returns the key in progress.
+    
+    Handles the flat "key: value" subset used by agent and skill files.
+    Quoted values are unquoted; indented continuation lines (block scalars,
+    nested maps) are folded into the previous key's value as text.
+    """
+    match = FRONT_MATTER_KEY_RE.match(line)
+    if match:
+        key, value = match.group(1), match.group(2) or ""
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        metadata[key] = "" if value in ('|', '>', '|-', '>-') else value
+        return key
+    if key is not None and line[:1] in (' ', '\t') and line.strip():
+        previous = metadata[key]
+        metadata[key] = f"{previous} {line.strip()}" if previous else line.strip()
+    return key
+
+
+def _line_key(node: AnnotationNode) -> int:
+    return node.line_number
+
+
+def _bundle_line_key(bundle: PromptBundle) -> int:
+    return bundle.start_line
+
+
+def _splice(items: list, first_line: int, last_line: int, new_items: list, key) -> None:
+    """Replace the items of a line-ordered list that fall in [first_line, last_line]."""
+    lo = bisect.bisect_left(items, first_line, key=key)
+    hi = bisect.bisect_right(items, last_line, key=key)
+    items[lo:hi] = new_items
+
+
+def find_node(parsed: ParsedAnnotations, line_number: int) -> list[AnnotationNode]:
+    """Return the chain of nodes enclosing a 1-based line, outermost first.
+    
+    The last element is the innermost node; empty if the line is outside
+    every annotation. Cost is O(depth * log(siblings)).
+    """
+    path = []
+    siblings = parsed.root_nodes
+    while siblings:
+        idx = bisect.bisect_right(siblings, line_number, key=_line_key) - 1
+        if idx < 0:
+            break
+        node = siblings[idx]
+        if line_number > parsed.end_line_of(node):
+            break
+        path.append(node)
+        siblings = node.children
+    return path
+
+
+def apply_edit(parsed: ParsedAnnotations, first_line: int, last_line: int,
+               new_lines: Sequence[str]) -> ParsedAnnotations:
+    """Replace source lines and update the parse tree incrementally.
+    
+    Lines first_line..last_line (1-based, inclusive) are replaced with
+    new_lines; use last_line = first_line - 1 to insert before first_line.
+    
+    Only the innermost closed annotation enclosing the edit is re-parsed
+    (widening to its ancestors if the edit unbalances it), so regex and
+    snippet work is proportional to that node, not the file. Node positions
+    are relative to the parent, so the splice only touches the node's
+    ancestors and their later siblings; the node lists, section indexes
+    and line_offsets are rebuilt when next read. Edits that no
+    enclosing node can absorb (top-level text, section changes that leak
+    out of the node, new "---" lines) fall back to a full parse, as does
+    widening once it has re-parsed twice as many lines as the file holds.
+    
+    Only parsed's own source_lines (a copy made by parse_lines()) is
+    changed; the list the document was parsed from is left alone.
+    
+    Returns:
+        parsed, updated in place, or a freshly parsed result on fallback
+    """
+    new_lines = list(new_lines)
+    source = parsed.source_lines
+    edit_end = max(first_line, last_line)
+    # A new "---" line can close front matter opened before the edit, which
+    # changes how everything in between was read
+    path = [] if any(line.strip() == '---' for line in new_lines) else find_node(parsed, first_line)
+    # Old and new lines re-parsed so far; past twice the file size (what a
+    # failed attempt plus a full parse would cost) stop widening
+    work = 0
+    
+    for depth in range(len(path) - 1, -1, -1):
+        node = path[depth]
+        # Edit must lie inside this closed node (an insert before its
+        # opening line is outside it)
+        if not node.end_line or edit_end > node.end_line:
+            continue
+        if last_line < first_line and first_line == node.line_number:
+            continue
+        start_idx = node.line_number - 1
+        work += 2 * (node.end_line - start_idx) + len(new_lines)
+        if work > 2 * len(source):
+            break
+        old_region = source[start_idx:node.end_line]
+        new_region = (old_region[:first_line - node.line_number] + new_lines +
+                      old_region[last_line - node.line_number + 1:])
         
-        # Add scope indicator if present
-        if node.scope:
-            label = f"{label} [{node.scope}]"
+        # Re-parse the old region too (cost is proportional to it) to learn
+        # the section and fence state the rest of the file depends on
+        old_end = _parse_region(ParsedAnnotations(), old_region,
+                                _line_offsets(old_region, node.start_offset),
+                                node.section, start_idx, node.fence)
+        scratch = ParsedAnnotations(agent_name=parsed.agent_name)
+        offsets = _line_offsets(new_region, node.start_offset)
+        new_end = _parse_region(scratch, new_region, offsets, node.section, start_idx, node.fence)
         
-        lines.append(f"{indent}{label}")
+        # The region must still be exactly one closed node, must leave the
+        # section/fence state seen by later lines unchanged, and must not
+        # close a fence (or leave a bundle open) across its boundary
+        if (len(scratch.root_nodes) != 1 or
+                scratch.root_nodes[0].line_number != node.line_number or
+                scratch.root_nodes[0].end_line != start_idx + len(new_region) or
+                new_end != old_end or new_end[2] or
+                any(not bundle.end_line for bundle in scratch.bundles)):
+            continue
         
-        for child in node.children:
-            render_node(child, depth + 1)
+        _splice_subtree(parsed, path[:depth], node, scratch, new_region)
+        return parsed
+    
+    # No enclosing node can absorb the edit - reparse everything
+    new_source = source[:first_line - 1] + new_lines + source[max(last_line, first_line - 1):]
+    return parse_lines(new_source, agent_name=parsed.source_name)
+
+
+def _splice_subtree(parsed: ParsedAnnotations, ancestors: list[AnnotationNode],
+                    old: AnnotationNode, scratch: ParsedAnnotations,
+                    new_region: list[str]) -> None:
+    """Move scratch's single root into old and shift its ancestors and later siblings."""
+    new = scratch.root_nodes[0]
+    first, last = old.line_number, old.end_line
+    line_delta = new.end_line - last
+    byte_delta = new.end_offset - old.end_offset
+    
+    for node, _ in walk_subtree([old]):
+        parsed.rollup.add(node, -1)
+    parsed.rollup.merge(scratch.rollup)
+    
+    # Bundles anchored on the scratch root move with old, which takes its place
+    for bundle in scratch.bundles:
+        if bundle._start[0] is new:
+            bundle._start = (old,) + bundle._start[1:]
+        if bundle._end[0] is new:
+            bundle._end = (old,) + bundle._end[1:]
+    _splice(parsed.bundles, first, last, scratch.bundles, _bundle_line_key)
+    
+    # Find where the edit sits at each level before anything moves
+    levels = []
+    child = old
+    for parent in ancestors[::-1] + [None]:
+        siblings = parent.children if parent is not None else parsed.root_nodes
+        levels.append((parent, siblings, bisect.bisect_right(siblings, child.line_number, key=_line_key)))
+        child = parent
+    
+    # old keeps its identity (and place in its parent) but takes the new content
+    for name in ('tag', 'attributes', 'content_snippet', 'children', 'scope', 'section',
+                 'prefix', 'fence', 'open_text', 'close_text',
+                 '_lines', '_body_start', '_body_end', '_end'):
+        setattr(old, name, getattr(new, name))
+    for child in old.children:
+        child._parent = old
+    for node, _ in walk_subtree(old.children):
+        node._layout = parsed._layout
     
-    for node in parsed.root_nodes:
-        render_node(node, 1)
+    # Later siblings are relative to their parent, so only each level's
+    # siblings after the edit and the enclosing ancestors move
+    if line_delta or byte_delta:
+        for parent, siblings, after in levels:
+            for sibling in siblings[after:]:
+                sibling._line += line_delta
+                sibling._offset += byte_delta
+            if parent is not None:
+                if parent._lines:
+                    parent._lines += line_delta
+                parent._body_end += byte_delta
+                parent._end += byte_delta
+    
+    parsed.source_lines[first - 1:last] = new_region
+    # Invalidates every cached position, index and line offset
+    parsed._layout[0] += 1
+
+
+def mindmap_label(node: AnnotationNode) -> str:
+    """Mermaid mindmap label for a node: tag, escaped snippet, scope."""
+    label = node.tag
+    if node.content_snippet:
+        # Truncate and escape for mermaid
+        snippet = node.content_snippet[:30]
+        if len(node.content_snippet) > 30:
+            snippet += "..."
+        snippet = snippet.replace('"', "'").replace('(', '[').replace(')', ']')
+        label = f"{node.tag}: {snippet}"
+    
+    # Add scope indicator if present
+    if node.scope:
+        label = f"{label} [{node.scope}]"
+    return label
+
+
+def markmap_label(node: AnnotationNode) -> str:
+    """Markmap list-item label for a node: tag, snippet, scope."""
+    label = node.tag
+    if node.content_snippet:
+        snippet = node.content_snippet[:35]
+        if len(node.content_snippet) > 35:
+            snippet += "..."
+        label = f"{label}: {snippet}"
+    if node.scope:
+        label = f"{label} `[{node.scope}]`"
+    return label
+
+
+def walk_subtree(roots: Sequence[AnnotationNode], depth: int = 0) -> Iterable[tuple[AnnotationNode, int]]:
+    """Yield (node, depth) in document order without recursion.
+    
+    Uses an explicit stack, so arbitrarily deep nesting can't hit Python's
+    recursion limit.
+    """
+    stack = [(node, depth) for node in reversed(roots)]
+    while stack:
+        node, node_depth = stack.pop()
+        yield node, node_depth
+        stack.extend((child, node_depth + 1) for child in reversed(node.children))
+
+
+def generate_mindmap(parsed: ParsedAnnotations) -> str:
+    """Generate Mermaid mindmap from parsed annotations."""
+    lines = ["```mermaid", "mindmap", f"  root(({parsed.agent_name}))"]
+    
+    for node, depth in walk_subtree(parsed.root_nodes, 1):
+        lines.append(f"{'    ' * depth}{mindmap_label(node)}")
     
     lines.append("```")
     return '\n'.join(lines)
@@ -270,21 +984,10 @@ def generate_markmap(parsed: ParsedAnnotations) -> str:
     """
     lines = [f"# {parsed.agent_name}"]
     
-    def render_node_content(node: AnnotationNode, indent: str = ""):
+    def render_node_content(node: AnnotationNode):
         """Render a node's content and children as list items."""
-        label = node.tag
-        if node.content_snippet:
-            snippet = node.content_snippet[:35]
-            if len(node.content_snippet) > 35:
-                snippet += "..."
-            label = f"{label}: {snippet}"
-        if node.scope:
-            label = f"{label} `[{node.scope}]`"
-        lines.append(f"{indent}- {label}")
-        
-        # Render children with deeper indent
-        for child in node.children:
-            render_node_content(child, indent + "  ")
+        for item, depth in walk_subtree([node]):
+            lines.append(f"{'  ' * depth}- {markmap_label(item)}")
     
     # Organize by document section to show structure
     for section, tags in sorted(parsed.section_tags.items()):
@@ -421,19 +1124,11 @@ def generate_summary(parsed: ParsedAnnotations) -> str:
         "",
     ]
     
-    # Scope breakdown
-    def count_by_scope(nodes: list[AnnotationNode]) -> dict:
-        counts = {'reusable': 0, 'phase-bound': 0, 'workflow': 0, 'unspecified': 0}
-        for node in nodes:
-            scope = node.scope if node.scope in counts else 'unspecified'
-            counts[scope] += 1
-        return counts
-    
-    all_nodes = (parsed.guardrails + parsed.workflow_steps + 
-                 parsed.decision_frameworks + parsed.artifacts + 
-                 parsed.quality_gates + parsed.handoffs)
-    
-    scope_counts = count_by_scope(all_nodes)
+    # Scope breakdown (over the categorized tags above); unknown scope
+    # values count as unspecified
+    category_scopes = parsed.rollup.category_scopes
+    scope_counts = {scope: category_scopes[scope] for scope in ('reusable', 'phase-bound', 'workflow')}
+    scope_counts['unspecified'] = sum(category_scopes.values()) - sum(scope_counts.values())
     lines.extend([
         "scope_breakdown:",
         f"  reusable: {scope_counts['reusable']}",
@@ -482,8 +1177,7 @@ def generate_summary(parsed: ParsedAnnotations) -> str:
                                      key=lambda x: len(x[1]), reverse=True):
             lines.append(f"  {tag}: # appears in {len(sections)} sections")
             for section in sections:
-                # Count how many of this tag in this section
-                count = sum(1 for t, _ in parsed.section_tags.get(section, []) if t == tag)
+                count = parsed.rollup.tag_sections[(tag, section)]
                 lines.append(f"    - \"{section}\" ({count}x)")
     else:
         lines.append("fragmented_tags: none  # All tag types are consolidated")
@@ -495,11 +1189,11 @@ def generate_summary(parsed: ParsedAnnotations) -> str:
         "sections:"
     ])
     
-    for section, tags in sorted(parsed.section_tags.items()):
-        tag_counts = {}
-        for tag, _ in tags:
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
-        
+    section_tag_counts: dict[str, dict[str, int]] = {}
+    for (tag, section), count in parsed.rollup.tag_sections.items():
+        section_tag_counts.setdefault(section, {})[tag] = count
+    
+    for section, tag_counts in sorted(section_tag_counts.items()):
         lines.append(f'  "{section}":')
         for tag, count in sorted(tag_counts.items()):
             lines.append(f"    {tag}: {count}")
@@ -510,6 +1204,7 @@ def generate_summary(parsed: ParsedAnnotations) -> str:
         "# Gap Detection",
         "potential_gaps:"
     ])
+    gaps_start = len(lines)
     
     if not parsed.guardrails:
         lines.append("  - WARNING: No guardrails found")
@@ -527,12 +1222,34 @@ def generate_summary(parsed: ParsedAnnotations) -> str:
         if tag in ('guardrail', 'workflow-step', 'decision-framework'):
             lines.append(f"  - NOTE: <{tag}> spread across {len(sections)} sections - consider consolidation")
     
-    if len(lines) == lines.index("potential_gaps:") + 1:
+    if len(lines) == gaps_start:
         lines.append("  - None detected")
     
     return '\n'.join(lines)
 
 
+# Output name -> (generator, filename suffix used with --output)
+GENERATORS = {
+    'mindmap': (generate_mindmap, '-mindmap.mmd'),
+    'markmap': (generate_markmap, '-by-section.mm.md'),
+    'markmap_by_tag': (generate_markmap_by_tag, '-by-tag.mm.md'),
+    'flow': (generate_flow_skeleton, '-flow.mmd'),
+    'summary': (generate_summary, '-summary.yaml'),
+}
+
+
+def generate_all(parsed: ParsedAnnotations, names: Optional[Sequence[str]] = None) -> dict[str, str]:
+    """Render visualizations from one parse, keyed by GENERATORS name.
+    
+    Args:
+        parsed: Result of parse_annotations/parse_text/parse_lines
+        names: Subset of GENERATORS keys to render (default: all)
+    """
+    if names is None:
+        names = list(GENERATORS)
+    return {name: GENERATORS[name][0](parsed) for name in names}
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Generate visualizations from annotated agent prompts.',
@@ -556,11 +1273,12 @@ def main():
     parsed = parse_annotations(args.file)
     
     # Generate outputs
-    mindmap = generate_mindmap(parsed)
-    markmap = generate_markmap(parsed)
-    markmap_by_tag = generate_markmap_by_tag(parsed)
-    flow = generate_flow_skeleton(parsed)
-    summary = generate_summary(parsed)
+    outputs_by_name = generate_all(parsed)
+    mindmap = outputs_by_name['mindmap']
+    markmap = outputs_by_name['markmap']
+    markmap_by_tag = outputs_by_name['markmap_by_tag']
+    flow = outputs_by_name['flow']
+    summary = outputs_by_name['summary']
     
     # Determine what to output
     show_all = not (args.mindmap or args.markmap or args.flow or args.summary)
@@ -570,11 +1288,11 @@ def main():
         args.output.mkdir(parents=True, exist_ok=True)
         base_name = args.file.stem.replace('.agent', '')
         
-        mindmap_path = args.output / f"{base_name}-mindmap.mmd"
-        markmap_path = args.output / f"{base_name}-by-section.mm.md"
-        markmap_tag_path = args.output / f"{base_name}-by-tag.mm.md"
-        flow_path = args.output / f"{base_name}-flow.mmd"
-        summary_path = args.output / f"{base_name}-summary.yaml"
+        mindmap_path = args.output / f"{base_name}{GENERATORS['mindmap'][1]}"
+        markmap_path = args.output / f"{base_name}{GENERATORS['markmap'][1]}"
+        markmap_tag_path = args.output / f"{base_name}{GENERATORS['markmap_by_tag'][1]}"
+        flow_path = args.output / f"{base_name}{GENERATORS['flow'][1]}"
+        summary_path = args.output / f"{base_name}{GENERATORS['summary'][1]}"
         
         with open(mindmap_path, 'w') as f:
             f.write(mindmap)